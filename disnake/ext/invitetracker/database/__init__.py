@@ -1,14 +1,37 @@
 from tortoise import Tortoise
+from tortoise.backends.base.config_generator import generate_config
 from ..logger import logger
 
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "temp_store": "MEMORY",
+    "cache_size": -20000,
+}
 
-async def init_database(db_url: str):
-    """Initialize the database."""
 
-    await Tortoise.init(
-        db_url=db_url,
-        modules={"models": ["disnake.ext.invitetracker.database.models.__init__"]},
+async def init_database(db_url: str, min_size: int = 5, max_size: int = 50):
+    """Initialize the database.
+
+    :param db_url: str: The database URL to use.
+    :param min_size: int: Minimum connections kept in the pool (pooled backends only).
+    :param max_size: int: Maximum connections in the pool (pooled backends only).
+    """
+    config = generate_config(
+        db_url,
+        app_modules={"models": ["disnake.ext.invitetracker.database.models.__init__"]},
     )
+    connection = config["connections"]["default"]
+    # options given in the URL query string take precedence
+    if connection["engine"].endswith("sqlite"):
+        # the sqlite client runs these as PRAGMAs on connect
+        for pragma, value in SQLITE_PRAGMAS.items():
+            connection["credentials"].setdefault(pragma, value)
+    else:
+        connection["credentials"].setdefault("minsize", min_size)
+        connection["credentials"].setdefault("maxsize", max_size)
+
+    await Tortoise.init(config=config)
     await Tortoise.generate_schemas()
     logger.info("[+] Database initialized")
 
@@ -2,7 +2,7 @@ import tortoise
 
 
 class GuildInviteModel(tortoise.Model):
-    code = tortoise.fields.CharField(max_length=255)
+    code = tortoise.fields.CharField(max_length=255, unique=True)
     uses = tortoise.fields.IntField(default=0)
 
     class Meta:
@@ -22,12 +22,13 @@ class GuildModel(tortoise.Model):
 class UserInvitedModel(tortoise.Model):
     id = tortoise.fields.BigIntField(pk=True)
     guild_id = tortoise.fields.BigIntField()
-    invite_code = tortoise.fields.CharField(max_length=255)
+    invite_code = tortoise.fields.CharField(max_length=255, index=True)
     joined_at = tortoise.fields.DatetimeField()
     inviter_id = tortoise.fields.BigIntField(null=True)
 
     class Meta:
         table = "user_invited"
+        indexes = (("inviter_id", "guild_id"), ("id", "guild_id"))
 
 
 class UserInviteModel(tortoise.Model):
@@ -0,0 +1,31 @@
+import sys
+
+from loguru import logger
+
+__all__ = ("logger", "logging_setup")
+
+LOG_FORMAT = (
+    "<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | "
+    "<cyan>{name}</cyan> - <level>{message}</level>"
+)
+_ERROR_NO = logger.level("ERROR").no
+
+
+def logging_setup(debug: bool = False) -> None:
+    """Configure loguru with enqueued stdout/stderr sinks.
+
+    This replaces every sink already added to loguru, so the extension never
+    calls it itself; call it from your bot if you want this setup. Records are
+    written by a background worker, so logging never blocks the event loop.
+
+    :param debug: bool: Log everything from DEBUG instead of WARNING and above.
+    """
+    logger.remove()
+    logger.add(
+        sys.stdout,
+        format=LOG_FORMAT,
+        level="DEBUG" if debug else "WARNING",
+        filter=lambda record: record["level"].no < _ERROR_NO,
+        enqueue=True,
+    )
+    logger.add(sys.stderr, format=LOG_FORMAT, level="ERROR", enqueue=True)
@@ -1,11 +1,12 @@
-from typing import Union
+from typing import List, Optional, Union
 
-from async_lru import alru_cache
-from disnake import Guild, Member
+from disnake import Guild, Invite, Member
 from disnake.ext.commands import InteractionBot, Bot
+from tortoise import Tortoise
 
 from .database import init_database, close_database
 from .database.models import UserInvitedModel
+from .util.cache import TTLCache
 from .util.database import Database
 
 
@@ -19,6 +20,9 @@ class InviteTracker:
         initialize_db: bool = True,
         use_cache: bool = True,
         debug: bool = False,
+        db_min_size: int = 5,
+        db_max_size: int = 50,
+        preload_invites: bool = True,
     ) -> None:
         """
         Initialize the InviteTracker.
@@ -58,6 +62,14 @@ class InviteTracker:
         :type use_cache: Bool
         :param debug: Enable debug mode.
         :type debug: Bool
+        :param db_min_size: Minimum number of pooled database connections (ignored for SQLite).
+        :type db_min_size: Int
+        :param db_max_size: Maximum number of pooled database connections (ignored for SQLite).
+        :type db_max_size: Int
+        :param preload_invites: Fetch the invites of every guild when the bot is ready.
+            If False, a guild's invite uses are loaded from the database on its first member join instead,
+            which saves one API request per guild on restart.
+        :type preload_invites: Bool
         """
 
         self.bot: Union[InteractionBot, Bot] = bot
@@ -66,23 +78,22 @@ class InviteTracker:
         self.initialize_db: bool = initialize_db
         self.background: bool = background
         self.debug = debug
+        self.db_min_size: int = db_min_size
+        self.db_max_size: int = db_max_size
+        self.preload_invites: bool = preload_invites
 
         if self.initialize_db:
-            self.bot.loop.create_task(self._load_database())
-            self.bot.add_listener(self._unload_database, "on_disconnect")
+            self.bot.add_listener(self._load_database, "on_connect")
 
         self.database_instance = Database(self.bot, debug=self.debug)
+        self._inviter_cache = TTLCache(maxsize=10_000, ttl=300)
+        self._invited_members_cache = TTLCache(maxsize=10_000, ttl=300)
 
         if self.background:
-            # self.bot.add_listener(self._load_database, "on_connect")
-            # self.bot.add_listener(self._unload_database, "on_disconnect")
-
-            self.bot.loop.create_task(self.database_instance.load_invites_to_cache())
-
-            # self.bot.add_listener(
-            # self.database_instance.load_invites_to_cache, "on_ready"
-            # )
-
+            if self.preload_invites:
+                self.bot.add_listener(
+                    self.database_instance.load_invites_to_cache, "on_ready"
+                )
             self.bot.add_listener(
                 self.database_instance.add_new_guild_invites, "on_guild_join"
             )
@@ -90,13 +101,16 @@ class InviteTracker:
                 self.database_instance.remove_guild_invites, "on_guild_remove"
             )
             self.bot.add_listener(self.database_instance.add_invite, "on_invite_create")
-            self.bot.add_listener(
-                self.database_instance.delete_invite, "on_invite_delete"
-            )
+            self.bot.add_listener(self._on_invite_delete, "on_invite_delete")
 
     async def _load_database(self) -> None:
-        """Load the database."""
-        await init_database(db_url=self.db_url)
+        """Load the database. Does nothing if Tortoise is already initialized."""
+        if Tortoise._inited:
+            return
+
+        await init_database(
+            db_url=self.db_url, min_size=self.db_min_size, max_size=self.db_max_size
+        )
         # await init_database()
 
     @staticmethod
@@ -104,34 +118,92 @@ class InviteTracker:
         """Unload the database."""
         await close_database()
 
-    @alru_cache(maxsize=1000)
-    async def get_inviter(self, member_id: int, guild: Guild):
-        user_invited = await UserInvitedModel.get_or_none(
-            id=member_id, guild_id=guild.id
+    async def get_inviter(self, member_id: int, guild: Guild) -> Optional[Member]:
+        key = (guild.id, member_id)
+        if key in self._inviter_cache:
+            return self._inviter_cache.get(key)
+
+        inviter = None
+        inviter_id = (
+            await UserInvitedModel.filter(id=member_id, guild_id=guild.id)
+            .first()
+            .values_list("inviter_id", flat=True)
         )
-        if user_invited and user_invited.inviter_id:
-            return await guild.fetch_member(user_invited.inviter_id)
+        if inviter_id:
+            inviter = await guild.fetch_member(inviter_id)
+
+        self._inviter_cache.set(key, inviter)
+        return inviter
 
-        return None
+    async def get_invited_members(self, user_id: int, guild: Guild) -> List[Member]:
+        key = (guild.id, user_id)
+        if key in self._invited_members_cache:
+            return self._invited_members_cache.get(key)
 
-    @alru_cache(maxsize=1000)
-    async def get_invited_members(self, user_id: int, guild: Guild):
-        invites = await UserInvitedModel.filter(
+        members = await self._fetch_invited_members(user_id, guild)
+        self._invited_members_cache.set(key, members)
+        return members
+
+    @staticmethod
+    async def _fetch_invited_members(user_id: int, guild: Guild) -> List[Member]:
+        ids = await UserInvitedModel.filter(
             inviter_id=user_id, guild_id=guild.id
-        ).all()
-        if invites:
-            return [await guild.fetch_member(invite.id) for invite in invites]
+        ).values_list("id", flat=True)
+        if not ids:
+            return []
+
+        members: List[Member] = []
+        missing: List[int] = []
+        for i in ids:
+            if (member := guild.get_member(i)) is not None:
+                members.append(member)
+            else:
+                missing.append(i)
+
+        # query_members accepts at most 100 user IDs per gateway request
+        for start in range(0, len(missing), 100):
+            members += await guild.query_members(
+                user_ids=missing[start : start + 100], limit=100, cache=True
+            )
 
-        return []
+        return members
 
     async def add_member(self, member: Member) -> None:
         """Add a member to the database."""
-        await self.database_instance.add_member(member)
+        user_invited = await self.database_instance.add_member(member)
+        self.invalidate(member.guild.id, member.id)
+        if user_invited and user_invited.inviter_id:
+            self._invited_members_cache.invalidate(
+                (member.guild.id, user_invited.inviter_id)
+            )
 
     async def delete_member(self, member: Member) -> None:
         """Delete a member from the database."""
-        await self.database_instance.delete_member(member)
+        user_invited = await self.database_instance.delete_member(member)
+        self.invalidate(member.guild.id, member.id)
+        if user_invited and user_invited.inviter_id:
+            self._invited_members_cache.invalidate(
+                (member.guild.id, user_invited.inviter_id)
+            )
+
+    def invalidate(self, guild_id: int, member_id: int) -> None:
+        """Drop the cached inviter and invited members of a member."""
+        self._inviter_cache.invalidate((guild_id, member_id))
+        self._invited_members_cache.invalidate((guild_id, member_id))
+
+    async def bulk_delete_invites(self, invites: List[Invite]) -> None:
+        """Delete many invites and their recorded usages from the database at once."""
+        await self.database_instance.bulk_delete_invites(invites)
+        self._invalidate_guilds({invite.guild.id for invite in invites})
+
+    async def _on_invite_delete(self, invite: Invite) -> None:
+        await self.database_instance.delete_invite(invite)
+        self._invalidate_guilds({invite.guild.id})
+
+    def _invalidate_guilds(self, guild_ids: set) -> None:
+        # deleting an invite removes every usage recorded for it in the guild
+        def in_guilds(key) -> bool:
+            return key[0] in guild_ids
 
-    def _remove_from_lru(self, member_id: int):
-        self.get_invited_members.cache_invalidate(member_id)
-        self.get_inviter.cache_invalidate(member_id)
+        self._inviter_cache.invalidate_if(in_guilds)
+        self._invited_members_cache.invalidate_if(in_guilds)
@@ -1,6 +1,9 @@
+import asyncio
 import collections
+import sys
+import time
 
-from typing import Optional, Union, TypeVar
+from typing import Any, Callable, Hashable, Optional, Union, TypeVar
 
 from disnake import Invite, Guild, Member, errors
 from disnake.ext.commands import InteractionBot, Bot
@@ -8,15 +11,78 @@ from disnake.ext.commands import InteractionBot, Bot
 from ..logger import logger
 
 
+class TTLCache:
+    """A bounded LRU mapping whose entries expire ``ttl`` seconds after being set.
+
+    A ``ttl`` of None keeps entries until they are evicted or invalidated.
+    All operations are O(1). The cache is only touched from the event loop,
+    so it needs no locking.
+    """
+
+    __slots__ = ("_data", "maxsize", "ttl")
+
+    def __init__(self, maxsize: int = 10_000, ttl: Optional[float] = 300) -> None:
+        self._data: "collections.OrderedDict[Hashable, tuple[float, Any]]" = (
+            collections.OrderedDict()
+        )
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+    def __contains__(self, key: Hashable) -> bool:
+        item = self._data.get(key)
+        if item is None:
+            return False
+        if item[0] < time.monotonic():
+            del self._data[key]
+            return False
+        return True
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Get a value from the cache, or ``default`` if it is missing or expired."""
+        if key not in self:
+            return default
+        self._data.move_to_end(key)
+        return self._data[key][1]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Store a value, evicting the least recently used entry if the cache is full."""
+        expires = float("inf") if self.ttl is None else time.monotonic() + self.ttl
+        self._data.pop(key, None)
+        self._data[key] = (expires, value)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        """Remove a value from the cache, if present."""
+        self._data.pop(key, None)
+
+    def invalidate_if(self, predicate: Callable[[Hashable], bool]) -> None:
+        """Remove every value whose key matches ``predicate``."""
+        for key in [key for key in self._data if predicate(key)]:
+            del self._data[key]
+
+    def clear(self) -> None:
+        """Remove every value from the cache."""
+        self._data.clear()
+
+
 class InviteCache:
+    __slots__ = ("_cache", "_uses", "_total_uses", "debug", "logger", "_fetch_sem")
+
+    #: Maximum number of ``guild.invites()`` requests in flight at once.
+    MAX_CONCURRENT_FETCHES = 25
+
     def __init__(self, debug: bool = False) -> None:
-        self._cache: dict[int, dict[str, Invite]] = collections.defaultdict()
+        self._cache: dict[int, dict[str, Invite]] = {}
+        # uses per code, kept alongside the full invites for the join hot path
+        self._uses: dict[int, dict[str, int]] = {}
+        self._total_uses: dict[int, int] = {}
         self.debug = debug
         self.logger = logger
-
-    def _debug(self, msg: str) -> None:
-        if self.debug:
-            self.logger.info(msg)
+        self._fetch_sem = asyncio.Semaphore(self.MAX_CONCURRENT_FETCHES)
 
     @property
     def cache(self) -> dict[int, dict[str, Invite]]:
@@ -34,9 +100,61 @@ class InviteCache:
         -------
         Invites from the cache
         """
-        invites = self._cache.get(guild_id, None)
-        self._debug(f"Found {len(invites)} invites in cache in guild {guild_id}")
-        return self._cache.get(guild_id, None)
+        invites = self._cache.get(guild_id)
+        if self.debug and invites is not None:
+            self.logger.debug(
+                "Found {} invites in cache in guild {}", len(invites), guild_id
+            )
+        return invites
+
+    def get_uses(self, guild_id: int) -> dict[str, int]:
+        """Get the cached uses of every invite in a guild.
+
+        Parameters
+        ----------
+        guild_id: int
+            The ID of the guild
+
+        Returns
+        -------
+        Mapping of invite codes to their uses
+        """
+        return self._uses.get(guild_id, {})
+
+    def get_total_uses(self, guild_id: int) -> int:
+        """Get the sum of the cached uses of every invite in a guild.
+
+        Parameters
+        ----------
+        guild_id: int
+            The ID of the guild
+
+        Returns
+        -------
+        Total invite uses in the guild
+        """
+        return self._total_uses.get(guild_id, 0)
+
+    def set_uses(self, guild_id: int, uses: dict[str, int]) -> None:
+        """Overwrite the cached uses of some invites in a guild.
+
+        Parameters
+        ----------
+        guild_id: int
+            The ID of the guild
+        uses: dict[str, int]
+            Mapping of invite codes to their uses
+        """
+        for code, count in uses.items():
+            self._set_uses(guild_id, code, count)
+
+    def _set_uses(self, guild_id: int, code: str, uses: int) -> None:
+        code = sys.intern(code)
+        guild_uses = self._uses.setdefault(guild_id, {})
+        self._total_uses[guild_id] = (
+            self._total_uses.get(guild_id, 0) + uses - guild_uses.get(code, 0)
+        )
+        guild_uses[code] = uses
 
     def update(
         self, guild_id: int, invites: Union[dict[str, Invite], Invite]
@@ -54,14 +172,27 @@ class InviteCache:
         -------
         Updated cache
         """
+        bucket = self._cache.setdefault(guild_id, {})
         if isinstance(invites, Invite):
-            old_invites = self._cache.get(guild_id, {})
-            old_invites[invites.code] = invites
-            invites = old_invites
+            bucket[sys.intern(invites.code)] = invites
+            self._set_uses(guild_id, invites.code, invites.uses)
+        else:
+            # sync the existing dicts in place so only the delta is reallocated
+            uses = self._uses.setdefault(guild_id, {})
+            for stale in bucket.keys() - invites.keys():
+                del bucket[stale]
+                uses.pop(stale, None)
+            bucket.update(
+                (sys.intern(code), invite) for code, invite in invites.items()
+            )
+            uses.update((code, invite.uses) for code, invite in bucket.items())
+            self._total_uses[guild_id] = sum(uses.values())
 
-        self._cache[guild_id] = invites
-        self._debug(f"Updated cache with {len(invites)} invites in guild {guild_id}")
-        return self._cache.get(guild_id, {})
+        if self.debug:
+            self.logger.debug(
+                "Updated cache with {} invites in guild {}", len(bucket), guild_id
+            )
+        return bucket
 
     def delete_invite(
         self, guild_id: int, invite_code: Union[Invite, str]
@@ -82,13 +213,12 @@ class InviteCache:
         if isinstance(invite_code, Invite):
             invite_code = invite_code.code
 
-        if guild_id in self._cache and invite_code in self._cache[guild_id]:
-            old_value = self._cache[guild_id][invite_code]
-            del self._cache[guild_id][invite_code]
-            self._debug(f"Deleted invite {invite_code} from guild {guild_id}")
-            return old_value
-
-        return
+        if guild_id in self._total_uses:
+            self._total_uses[guild_id] -= self._uses[guild_id].pop(invite_code, 0)
+        old_value = self._cache.get(guild_id, {}).pop(invite_code, None)
+        if self.debug and old_value is not None:
+            self.logger.debug("Deleted invite {} from guild {}", invite_code, guild_id)
+        return old_value
 
     def add_invite(self, guild_id: int, invite: Invite) -> Invite:
         """Add an invitation to the cache.
@@ -104,13 +234,69 @@ class InviteCache:
         -------
         Added invite (disnake.Invite) to the cache
         """
-        if guild_id not in self._cache:
-            self._cache[guild_id] = {}
-            self._debug(f"initialized cache for guild {guild_id}")
-        self._cache[guild_id][invite.code] = invite
-        self._debug(f"Added invite {invite.code} to the guild {guild_id} cache")
+        self._cache.setdefault(guild_id, {})[sys.intern(invite.code)] = invite
+        self._set_uses(guild_id, invite.code, invite.uses)
+        if self.debug:
+            self.logger.debug(
+                "Added invite {} to the guild {} cache", invite.code, guild_id
+            )
         return invite
 
+    def record_use(
+        self,
+        guild_id: int,
+        invites: list[Invite],
+        used: Optional[Invite],
+        concurrent: bool = False,
+    ) -> None:
+        """Sync the cache with live invites after a member joined.
+
+        Codes that no longer exist are dropped and every other code takes
+        its live uses. While other joins of the guild are still being
+        resolved (``concurrent``), only a single use of ``used`` is recorded
+        and the other codes are left alone, so members who joined
+        concurrently still match the remaining difference.
+
+        Parameters
+        ----------
+        guild_id: int
+            The ID of the guild
+        invites: list[disnake.Invite]
+            The live invites of the guild
+        used: Optional[disnake.Invite]
+            The invite the member joined with, if one was found
+        concurrent: bool
+            Whether other joins of the guild are still being resolved
+        """
+        live = {invite.code: invite for invite in invites}
+        if not concurrent:
+            self.update(guild_id, live)
+            return
+
+        cached = self._cache.setdefault(guild_id, {})
+        for stale in cached.keys() - live.keys():
+            self.delete_invite(guild_id, stale)
+        for code in live.keys() - cached.keys():
+            self._set_uses(guild_id, code, 0)
+        cached.update((sys.intern(code), invite) for code, invite in live.items())
+        if used is not None:
+            uses = self.get_uses(guild_id).get(used.code, 0)
+            self._set_uses(guild_id, used.code, min(used.uses, uses + 1))
+
+    def remove_guild(self, guild_id: int) -> None:
+        """Remove every invite of a guild from the cache.
+
+        Parameters
+        ----------
+        guild_id: int
+            The ID of the guild
+        """
+        self._cache.pop(guild_id, None)
+        self._uses.pop(guild_id, None)
+        self._total_uses.pop(guild_id, None)
+        if self.debug:
+            self.logger.debug("Removed guild {} from the cache", guild_id)
+
     async def update_invites_cache(self, guilds: list[Guild]) -> None:
         """Synchronize the cache with all guild invites.
 
@@ -121,9 +307,55 @@ class InviteCache:
         """
         logger.info("[~] [CACHE] Updating invites cache...")
 
-        for guild in guilds:
-            invites = {invite.code: invite for invite in await guild.invites()}
-            self.update(guild.id, invites)
+        results = await asyncio.gather(
+            *(self._fetch_guild_invites(guild) for guild in guilds),
+            return_exceptions=True,
+        )
+        for guild, result in zip(guilds, results):
+            if isinstance(result, BaseException):
+                logger.error(
+                    "[x] [CACHE] Failed to load invites from guild {}: {}",
+                    guild.id,
+                    result,
+                )
+                continue
+            guild_id, invites = result
+            if invites is not None:
+                self.update(guild_id, invites)
 
         logger.info("[+] [CACHE] Updated invites cache.")
         return
+
+    async def fetch_invites(self, guild: Guild) -> Optional[list[Invite]]:
+        """Fetch the invites of a guild from the API.
+
+        Every invites request of the extension goes through here, so at most
+        ``MAX_CONCURRENT_FETCHES`` are in flight at once. Guilds where the bot
+        lacks Manage Server are skipped instead of spending a request on a 403.
+
+        Parameters
+        ----------
+        guild: disnake.Guild
+            The guild to fetch invites from
+
+        Returns
+        -------
+        The invites of the guild, or None without Manage Server
+        """
+        if guild.me is None or not guild.me.guild_permissions.manage_guild:
+            if self.debug:
+                self.logger.debug(
+                    "[~] Missing Manage Server permission in guild {}", guild.id
+                )
+            return None
+
+        async with self._fetch_sem:
+            return await guild.invites()
+
+    async def _fetch_guild_invites(
+        self, guild: Guild
+    ) -> tuple[int, Optional[dict[str, Invite]]]:
+        invites = await self.fetch_invites(guild)
+        if invites is None:
+            return guild.id, None
+        return guild.id, {invite.code: invite for invite in invites}
@@ -1,8 +1,11 @@
+import asyncio
+import time
 import typing
 
-from async_lru import alru_cache
-from disnake import Guild, Invite, Member, errors
+from disnake import Guild, Invite, Member, errors, utils
 from disnake.ext.commands import InteractionBot, Bot
+from tortoise.transactions import in_transaction
+
 from ..database.models import (
     GuildModel,
     GuildInviteModel,
@@ -10,70 +13,231 @@ from ..database.models import (
 )
 
 from ..logger import logger
-from ..util.cache import InviteCache
+from ..util.cache import InviteCache, TTLCache
 
 
 class Database:
+    __slots__ = (
+        "bot",
+        "invite_cache",
+        "_live_invites",
+        "_pending_invites",
+        "_flush_task",
+        "_invite_models",
+        "_guild_models",
+        "_sync_sem",
+        "_guild_invites",
+        "_pending_invite_deletes",
+        "_pending_guild_deletes",
+        "_delete_task",
+        "_pending_joins",
+        "_pending_uses",
+        "_join_task",
+        "_resolving_joins",
+    )
+
+    #: Seconds a fetched invite list is reused by following member joins.
+    LIVE_INVITES_TTL = 1.0
+    #: Rows per statement for bulk invite writes.
+    BULK_BATCH_SIZE = 500
+    #: Maximum number of guilds synced to the database at once.
+    MAX_CONCURRENT_SYNCS = 16
+    #: Seconds the result of get_guild_invites is reused.
+    GUILD_INVITES_TTL = 60.0
+    #: Seconds deletions are collected before being written in one statement.
+    DELETE_FLUSH_DELAY = 0.2
+    #: Seconds member joins are collected before being written in one batch.
+    JOIN_FLUSH_DELAY = 0.1
+
     def __init__(
         self, bot: typing.Union[InteractionBot, Bot], debug: bool = False
     ) -> None:
         self.bot = bot
         self.invite_cache = InviteCache(debug=debug)
+        self._live_invites: dict[int, tuple[float, list[Invite]]] = {}
+        self._pending_invites: list[Invite] = []
+        self._flush_task: typing.Optional[asyncio.Task] = None
+        # (guild_id, code) -> GuildInviteModel, filled by find_invite_in_guild
+        self._invite_models = TTLCache(maxsize=4096, ttl=None)
+        self._guild_models: dict[int, GuildModel] = {}
+        self._sync_sem = asyncio.Semaphore(self.MAX_CONCURRENT_SYNCS)
+        # guild_id -> invites returned by get_guild_invites, dropped on invite events
+        self._guild_invites = TTLCache(maxsize=1024, ttl=self.GUILD_INVITES_TTL)
+        self._pending_invite_deletes: set[str] = set()
+        self._pending_guild_deletes: set[int] = set()
+        self._delete_task: typing.Optional[asyncio.Task] = None
+        self._pending_joins: list[UserInvitedModel] = []
+        # code -> latest uses, written together with the queued joins
+        self._pending_uses: dict[str, int] = {}
+        self._join_task: typing.Optional[asyncio.Task] = None
+        # guild_id -> number of joins whose invite is still being looked up
+        self._resolving_joins: dict[int, int] = {}
+
+    async def _get_live_invites(
+        self, guild: Guild, refresh: bool = False
+    ) -> tuple[typing.Optional[list[Invite]], bool]:
+        """Get the guild's invites, reusing a list fetched less than a second ago.
+
+        Returns the invites (None without Manage Server) and whether they came
+        from the short-lived cache.
+        """
+        now = time.monotonic()
+        cached = self._live_invites.get(guild.id)
+        if not refresh and cached and now - cached[0] < self.LIVE_INVITES_TTL:
+            return cached[1], True
+
+        invites = await self.invite_cache.fetch_invites(guild)
+        if invites is not None:
+            self._live_invites[guild.id] = (now, invites)
+        return invites, False
+
+    def _find_used_invite(
+        self, guild_id: int, invites: list[Invite]
+    ) -> typing.Optional[Invite]:
+        old_uses = self.invite_cache.get_uses(guild_id)
+        # equal totals over the same codes mean no invite was used (vanity URL,
+        # discovery, ...); a code that vanished could hide a use elsewhere
+        if (
+            len(invites) == len(old_uses)
+            and sum(invite.uses for invite in invites)
+            == self.invite_cache.get_total_uses(guild_id)
+            and all(invite.code in old_uses for invite in invites)
+        ):
+            return None
 
-    async def _get_invite_for_member(self, member: Member) -> typing.Optional[Invite]:
-        logger.info(f"Checking invites for member {member}")
-        current_invites = await member.guild.invites()
+        for invite in invites:
+            if invite.uses > old_uses.get(invite.code, 0):
+                return invite
+        return None
 
-        old_invites = self.invite_cache.get(member.guild.id)
+    async def _load_uses_from_db(self, guild_id: int, invites: list[Invite]) -> None:
+        """Seed a cold guild cache with the uses stored in the database (one query).
 
-        for invite in current_invites:
-            old_invite = old_invites.get(invite.code)
-            if old_invite and invite.uses > old_invite.uses:
-                self.invite_cache.add_invite(member.guild.id, invite)
-                logger.info(f"Found invite {invite.code} for member {member}")
-                return invite
+        Codes the database doesn't know start at their live uses: we can't tell
+        whether one of their uses is this join, so they are never reported as used.
+        """
+        stored = dict(
+            await GuildInviteModel.filter(
+                guilds__id=guild_id, code__in=[invite.code for invite in invites]
+            ).values_list("code", "uses")
+        )
+        self.invite_cache.update(guild_id, {invite.code: invite for invite in invites})
+        self.invite_cache.set_uses(guild_id, stored)
+        logger.debug(
+            "[~] [DB] Seeded {} invite uses for guild {}", len(stored), guild_id
+        )
+
+    async def _get_invite_for_member(self, member: Member) -> typing.Optional[Invite]:
+        logger.info("Checking invites for member {}", member)
+        guild = member.guild
+        self._resolving_joins[guild.id] = self._resolving_joins.get(guild.id, 0) + 1
+        try:
+            current_invites, reused = await self._get_live_invites(guild)
+            if current_invites is None:
+                # no Manage Server permission, there is nothing to diff against
+                return None
+            if guild.id not in self.invite_cache.cache:
+                await self._load_uses_from_db(guild.id, current_invites)
+
+            found = self._find_used_invite(guild.id, current_invites)
+
+            if found is None and reused:
+                # the reused list may have been fetched before this member joined
+                refreshed, _ = await self._get_live_invites(guild, refresh=True)
+                if refreshed is not None:
+                    current_invites = refreshed
+                    found = self._find_used_invite(guild.id, current_invites)
+
+            self.invite_cache.record_use(
+                guild.id,
+                current_invites,
+                found,
+                concurrent=self._resolving_joins[guild.id] > 1,
+            )
+        finally:
+            if self._resolving_joins[guild.id] == 1:
+                del self._resolving_joins[guild.id]
+            else:
+                self._resolving_joins[guild.id] -= 1
+        self._guild_invites.invalidate(guild.id)
+
+        if found is None:
+            logger.warning("No matching invite found for member {}", member)
+            return
 
-        logger.warning(f"No matching invite found for member {member}")
-        return
+        logger.info("Found invite {} for member {}", found.code, member)
+        return found
 
     async def load_invites_to_cache(self) -> None:
         """
         Load all invites from all guilds in the cache.
 
         This function is used to pre-cache all invites when the bot is ready.
+        The fetched invites are then stored in the database, a few guilds at
+        a time.
         """
 
         await self.invite_cache.update_invites_cache(self.bot.guilds)
+        await asyncio.gather(
+            *(self._bounded_add_invs_to_db(guild) for guild in self.bot.guilds)
+        )
+
+    async def _bounded_add_invs_to_db(self, guild: Guild) -> None:
+        if (invites := self.invite_cache.get(guild.id)) is None:
+            return
+
+        async with self._sync_sem:
+            try:
+                await self._add_invs_to_db(guild, list(invites.values()))
+            except Exception as e:
+                logger.error(
+                    "[x] [DB] Failed to store invites of guild {}: {}", guild.id, e
+                )
+
+    async def _get_guild_model(self, guild_id: int) -> GuildModel:
+        """Get (or create) the guild row, remembering it for later calls."""
+        # the guild is back, don't let a queued removal delete it again
+        self._pending_guild_deletes.discard(guild_id)
+        if (guild := self._guild_models.get(guild_id)) is None:
+            guild, _ = await GuildModel.get_or_create(id=guild_id)
+            self._guild_models[guild_id] = guild
+        return guild
 
-    @staticmethod
     async def find_invite_in_guild(
-        guild_id: int, code: str
+        self, guild_id: int, code: str
     ) -> typing.Optional[GuildInviteModel]:
         """
         Find an invitation in a guild (Database only)
 
+        Results are kept in an LRU cache that is invalidated whenever this
+        class writes or deletes the invite. This is an instance method; it
+        used to be a staticmethod, so call it on a Database instance.
+
         :param guild_id: int: The guild ID.
         :param code: str: The invite code.
         :return: Optional[GuildInviteModel]: The GuildInviteModel object or None if not found.
         """
-        guild = await GuildModel.get_or_none(id=guild_id).prefetch_related("invites")
-
-        if guild is None:
-            guild = await GuildModel.create(id=guild_id)
+        key = (guild_id, code)
+        if (cached := self._invite_models.get(key)) is not None:
+            return cached
 
-        invite = await guild.invites.filter(code=code).first()
-
-        if invite is None:
-            invite = await GuildInviteModel.create(code=code, uses=0)
+        invite, created = await GuildInviteModel.get_or_create(
+            defaults={"uses": 0}, code=code
+        )
+        if created:
+            guild = await self._get_guild_model(guild_id)
             await guild.invites.add(invite)
 
+        self._invite_models.set(key, invite)
         return invite
 
-    @alru_cache(maxsize=None)
     async def get_guild_invites(self, guild: Guild) -> typing.Optional[list[Invite]]:
         """
         Get all invites from a guild.
 
+        Results are reused for ``GUILD_INVITES_TTL`` seconds, or until an
+        invite of the guild is created, deleted or used.
+
         Parameters
         ----------
         guild: disnake.Guild
@@ -84,26 +248,54 @@ class Database:
         list[disnake.Invite]
             A list of all invites in the guild
         """
+        if (cached := self._guild_invites.get(guild.id)) is not None:
+            return cached
+
         try:
-            invites = await guild.invites()
+            invites = await self.invite_cache.fetch_invites(guild)
+            if invites is not None:
+                self._guild_invites.set(guild.id, invites)
             return invites
         except (errors.HTTPException, errors.Forbidden):
             logger.error(
-                f"[x] Failed to get invites from guild {guild.id} due to permission error(s)"
+                "[x] Failed to get invites from guild {} due to permission error(s)",
+                guild.id,
             )
             return None
 
-    async def _add_invs_to_db(self, guild: Guild) -> None:
-        if not (invites := await self.get_guild_invites(guild)):
+    async def _add_invs_to_db(
+        self, guild: Guild, invites: typing.Optional[list[Invite]] = None
+    ) -> None:
+        if invites is None:
+            invites = await self.get_guild_invites(guild)
+        if not invites:
             return
 
-        for invite in invites:
-            data = await self.find_invite_in_guild(guild.id, invite.code)
-            data.uses = invite.uses
-            await data.save()
-            logger.debug(f"[+] [DB] Added invite {invite.code} from guild {guild.id}")
+        guild_model = await self._get_guild_model(guild.id)
+        stored = {data.code: data for data in await guild_model.invites.all()}
 
-            logger.info(f"[+] [DB] Added guild {guild.id} to the cache.")
+        changed: list[GuildInviteModel] = []
+        missing: dict[str, int] = {}
+        for invite in invites:
+            data = stored.get(invite.code)
+            if data is None:
+                missing[invite.code] = invite.uses
+            elif data.uses != invite.uses:
+                data.uses = invite.uses
+                changed.append(data)
+                self._invite_models.invalidate((guild.id, data.code))
+
+        # one commit (and one fsync on SQLite) for the whole guild
+        async with in_transaction():
+            if changed:
+                await GuildInviteModel.bulk_update(
+                    changed, fields=["uses"], batch_size=self.BULK_BATCH_SIZE
+                )
+            if missing:
+                await self._link_guild_invites(guild_model, missing)
+
+        logger.debug("[+] [DB] Added {} invites from guild {}", len(invites), guild.id)
+        logger.info("[+] [DB] Added guild {} to the database.", guild.id)
 
     async def add_new_guild_invites(self, guild: Guild) -> None:
         """
@@ -114,8 +306,15 @@ class Database:
         guild: disnake.Guild
             The guild to add invites from
         """
-        # await self.([guild])
-        await self._add_invs_to_db(guild)
+        invites = await self.get_guild_invites(guild)
+        if invites is None:
+            # a failed fetch leaves the guild uncached, its first join seeds it
+            return
+
+        self.invite_cache.update(guild.id, {invite.code: invite for invite in invites})
+        logger.info("[+] [CACHE] Added guild {} to the cache.", guild.id)
+
+        await self._add_invs_to_db(guild, invites)
 
     async def remove_guild_invites(self, guild: Guild) -> None:
         """
@@ -126,59 +325,155 @@ class Database:
         guild: disnake.Guild
             The guild to remove invites from
         """
-        if not (invites := await self.get_guild_invites(guild)):
-            return
-
-        logger.info(f"[~] [CACHE] Removing guild {guild.id} from the cache")
-        for invite in invites:
-            self.invite_cache.delete_invite(guild.id, invite.code)
-        del self.invite_cache.cache[guild.id]
-        logger.info(f"[+] [CACHE] Removed guild {guild.id} from the cache")
-
-        await GuildModel.filter(id=guild.id).delete()
-        logger.info(f"[+] [DB] Removed guild {guild.id} from the database")
-
-    async def add_invite(self, invite: Invite) -> GuildModel:
+        logger.info("[~] [CACHE] Removing guild {} from the cache", guild.id)
+        self.invite_cache.remove_guild(guild.id)
+        self._live_invites.pop(guild.id, None)
+        self._guild_invites.invalidate(guild.id)
+        self._invite_models.invalidate_if(lambda key: key[0] == guild.id)
+        self._guild_models.pop(guild.id, None)
+        logger.info("[+] [CACHE] Removed guild {} from the cache", guild.id)
+
+        self._pending_guild_deletes.add(guild.id)
+        self._schedule_deletes()
+
+    async def add_invite(self, invite: Invite) -> None:
         """
         Add an invitation to the database.
 
+        The invite is cached immediately; the database write is queued and
+        flushed together with every other invite created in the same
+        event loop iteration.
+
         Parameters
         ----------
         invite: disnake.Invite
-            The invite which was used to join the guild
-
-        Returns
-        -------
-        UserInvitedModel
-            The newly created or existing UserInvitedModel instance
+            The invite which was created
         """
-        logger.info(f"Invite created: {invite.code} in guild {invite.guild.name}")
+        logger.info("Invite created: {} in guild {}", invite.code, invite.guild.name)
         self.invite_cache.add_invite(invite.guild.id, invite)
+        self._guild_invites.invalidate(invite.guild.id)
 
-        guild_model, created = await GuildModel.get_or_create(id=invite.guild.id)
-        invite_model, created = await GuildInviteModel.get_or_create(code=invite.code)
+        self._pending_invite_deletes.discard(invite.code)
+        self._pending_invites.append(invite)
+        if self._flush_task is None:
+            self._flush_task = self.bot.loop.create_task(self._flush_invites())
 
-        await guild_model.invites.add(invite_model)
-        logger.info(
-            f"Invite {invite.code} {'created' if created else 'added'} to the database."
-        )
-        return guild_model
+    async def _link_guild_invites(
+        self, guild_model: GuildModel, uses: dict[str, int]
+    ) -> None:
+        """Create the missing invite rows in bulk and link them all to the guild.
+
+        :param guild_model: GuildModel: The guild to link the invites to.
+        :param uses: dict[str, int]: Uses of each invite code, used for new rows.
+        """
+        invite_models = await GuildInviteModel.filter(code__in=list(uses))
+        new_codes = uses.keys() - {invite_model.code for invite_model in invite_models}
+        if new_codes:
+            await GuildInviteModel.bulk_create(
+                [GuildInviteModel(code=code, uses=uses[code]) for code in new_codes],
+                batch_size=self.BULK_BATCH_SIZE,
+            )
+            # bulk_create doesn't report primary keys, read the new rows back
+            invite_models += await GuildInviteModel.filter(code__in=list(new_codes))
+
+        await guild_model.invites.add(*invite_models)
+
+    async def _flush_invites(self) -> None:
+        invites, self._pending_invites = self._pending_invites, []
+        self._flush_task = None
+
+        codes_by_guild: dict[int, list[str]] = {}
+        for invite in invites:
+            codes_by_guild.setdefault(invite.guild.id, []).append(invite.code)
+
+        try:
+            async with in_transaction():
+                for guild_id, codes in codes_by_guild.items():
+                    guild_model = await self._get_guild_model(guild_id)
+                    await self._link_guild_invites(guild_model, dict.fromkeys(codes, 0))
+        except Exception as e:
+            logger.error("[x] [DB] Failed to add {} invites: {}", len(invites), e)
+            return
+
+        logger.info("{} invites added to the database.", len(invites))
 
     async def delete_invite(self, invite: Invite) -> None:
         """
         Delete an invitation from the database.
 
+        The deletion is written together with every other deletion queued in
+        the next ``DELETE_FLUSH_DELAY`` seconds; this returns once it is done.
+
         Parameters
         ----------
         invite: disnake.Invite
             The invite to delete
         """
-        logger.info(f"Deleting invite {invite.code} from the database")
+        logger.info("Deleting invite {} from the database", invite.code)
+        self._forget_invite(invite)
+
+        self._pending_invite_deletes.add(invite.code)
+        self._schedule_deletes()
+        # return only once the usages are gone, callers drop their caches then
+        await asyncio.shield(self._delete_task)
+
+    async def bulk_delete_invites(self, invites: list[Invite]) -> None:
+        """
+        Delete many invitations from the database at once.
+
+        The usages of every invite are removed with a single statement.
+
+        Parameters
+        ----------
+        invites: list[disnake.Invite]
+            The invites to delete
+        """
+        if not invites:
+            return
+
+        codes = {invite.code for invite in invites}
+        for invite in invites:
+            self._forget_invite(invite)
+        self._pending_invite_deletes -= codes
+
+        await UserInvitedModel.filter(invite_code__in=codes).delete()
+        logger.info("{} invites deleted from the database", len(codes))
+
+    def _forget_invite(self, invite: Invite) -> None:
         self.invite_cache.delete_invite(invite.guild.id, invite.code)
-        await UserInvitedModel.filter(invite_code=invite.code).delete()
-        logger.info(f"Invite {invite.code} deleted from the database")
+        self._guild_invites.invalidate(invite.guild.id)
+        self._invite_models.invalidate((invite.guild.id, invite.code))
+
+    def _schedule_deletes(self) -> None:
+        if self._delete_task is None:
+            self._delete_task = self.bot.loop.create_task(self._flush_deletes())
 
-    async def add_member(self, member: Member) -> None:
+    async def _flush_deletes(self) -> None:
+        """Write every deletion queued during the last ``DELETE_FLUSH_DELAY`` seconds."""
+        await asyncio.sleep(self.DELETE_FLUSH_DELAY)
+        codes, self._pending_invite_deletes = self._pending_invite_deletes, set()
+        guild_ids, self._pending_guild_deletes = self._pending_guild_deletes, set()
+        self._delete_task = None
+
+        try:
+            if codes:
+                await UserInvitedModel.filter(invite_code__in=codes).delete()
+                logger.info("{} invites deleted from the database", len(codes))
+            if guild_ids:
+                async with in_transaction():
+                    # invite codes are unique to a guild, drop them with it
+                    invite_ids = await GuildInviteModel.filter(
+                        guilds__id__in=guild_ids
+                    ).values_list("id", flat=True)
+                    await GuildInviteModel.filter(id__in=invite_ids).delete()
+                    await GuildModel.filter(id__in=guild_ids).delete()
+                logger.info(
+                    "[+] [DB] Removed {} guilds from the database", len(guild_ids)
+                )
+        except Exception as e:
+            logger.error("[x] [DB] Failed to write queued deletions: {}", e)
+
+    async def add_member(self, member: Member) -> typing.Optional[UserInvitedModel]:
         """
         Add a member to the database.
 
@@ -186,26 +481,67 @@ class Database:
         ----------
         member: disnake.Member
             The member to add to the database
+
+        Returns
+        -------
+        Optional[UserInvitedModel]
+            The recorded invite usage or None if no invite was found
         """
-        logger.info(f"Member {member} joined to the guild {member.guild.name}")
+        logger.info("Member {} joined to the guild {}", member, member.guild.name)
         invite = await self._get_invite_for_member(member)
 
         if not invite:
-            logger.warning(f"No invite found for member {member}")
+            logger.warning("No invite found for member {}", member)
             return
 
-        await UserInvitedModel.create(
+        user_invited = UserInvitedModel(
             id=member.id,
             guild_id=member.guild.id,
             invite_code=invite.code,
-            joined_at=member.joined_at,
+            joined_at=member.joined_at or utils.utcnow(),
             inviter_id=invite.inviter.id if invite.inviter else None,
         )
+        self._pending_joins.append(user_invited)
+        # keep the stored uses current for cold-cache lookups
+        self._pending_uses[invite.code] = self.invite_cache.get_uses(
+            member.guild.id
+        ).get(invite.code, invite.uses)
+        if self._join_task is None:
+            self._join_task = self.bot.loop.create_task(self._flush_joins())
+
+        # wait for the batch so the usage can be read back once this returns
+        await asyncio.shield(self._join_task)
+        self._invite_models.invalidate((member.guild.id, invite.code))
+
+        logger.info("Invite {} recorded for member {}", invite.code, member)
+        return user_invited
+
+    async def _flush_joins(self) -> None:
+        """Write every join queued during the last ``JOIN_FLUSH_DELAY`` seconds."""
+        await asyncio.sleep(self.JOIN_FLUSH_DELAY)
+        joins, self._pending_joins = self._pending_joins, []
+        uses, self._pending_uses = self._pending_uses, {}
+        self._join_task = None
+
+        # the member ID is the primary key, so a member's latest join wins,
+        # also over a row left from an earlier join or another guild
+        latest = list(
+            {user_invited.id: user_invited for user_invited in joins}.values()
+        )
+        async with in_transaction():
+            await UserInvitedModel.bulk_create(
+                latest,
+                batch_size=self.BULK_BATCH_SIZE,
+                on_conflict=["id"],
+                update_fields=["guild_id", "invite_code", "joined_at", "inviter_id"],
+            )
+            for code, count in uses.items():
+                await GuildInviteModel.filter(code=code).update(uses=count)
 
-        logger.info(f"Invite {invite.code} recorded for member {member}")
+        logger.info("{} invite usages added to the database", len(joins))
 
     @staticmethod
-    async def delete_member(member: Member) -> None:
+    async def delete_member(member: Member) -> typing.Optional[UserInvitedModel]:
         """
         Delete a member from the database.
 
@@ -213,14 +549,22 @@ class Database:
         ----------
         member: disnake.Member
             The member to delete from the database
+
+        Returns
+        -------
+        Optional[UserInvitedModel]
+            The deleted invite usage or None if the member was not recorded
         """
         result = await UserInvitedModel.filter(
             id=member.id, guild_id=member.guild.id
         ).first()
         if result:
             logger.info(
-                f"Deleting member {member.name} from the invite {result.invite_code} database"
+                "Deleting member {} from the invite {} database",
+                member.name,
+                result.invite_code,
             )
             await result.delete()
 
-        logger.info(f"Member {member.name} deleted from the database")
+        logger.info("Member {} deleted from the database", member.name)
+        return result